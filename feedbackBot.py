@@ -7,9 +7,18 @@ import logging
 import sqlite3
 from datetime import datetime, timedelta
 import json
-from notion_client import Client
 from datetime import datetime
 import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import uvloop  # Необязательная зависимость, доступна только на Linux/macOS
+except ImportError:
+    uvloop = None
+if uvloop is not None and not hasattr(uvloop, 'run'):
+    uvloop = None  # uvloop.run() появился в 0.18; со старыми версиями работаем на стандартном цикле
 
 
 # Настройка логирования
@@ -24,62 +33,225 @@ NOTION_MEETINGS_DB_ID = os.getenv("NOTION_MEETINGS_DB_ID")
 NOTION_FEEDBACK_DB_ID = os.getenv("NOTION_FEEDBACK_DB_ID")
 ERROR_CHAT_ID = os.getenv("ERROR_CHAT_ID")
 
+# Заголовки запросов к Notion API (для GET Content-Type не нужен)
+NOTION_GET_HEADERS = {
+    "Authorization": f"Bearer {NOTION_API_KEY}",
+    "Notion-Version": "2022-06-28"
+}
+NOTION_HEADERS = {**NOTION_GET_HEADERS, "Content-Type": "application/json"}
+
 
 
 # Константы
-POLLING_INTERVAL = 60 * 60 * 2   # 2 часов в секундах
-REMINDER_INTERVAL = 20 * 60 * 8  # 8 часов в секундах
+# Интервалы в секундах, переопределяются переменными окружения
+POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL_S", 60 * 60 * 2))
+REMINDER_INTERVAL = int(os.getenv("REMINDER_INTERVAL_S", 60 * 60 * 8))
+NOTION_CACHE_SIZE = 1024  # Максимум записей в кэше имён менторов
+# Записи живут дольше интервала напоминаний, чтобы имена менторов переживали паузу между проверками,
+# но не дольше суток, чтобы переименование ментора в Notion подхватывалось при любом REMINDER_INTERVAL_S
+NOTION_CACHE_TTL = min(REMINDER_INTERVAL + 60 * 60, 24 * 60 * 60)
+TELEGRAM_LONG_POLL_TIMEOUT = 50  # Сколько секунд Telegram держит getUpdates открытым
+TELEGRAM_MAX_BACKOFF = 60  # Максимальная задержка между повторами getUpdates при сетевых ошибках
+RATE_LIMIT_RETRIES = 5  # Сколько раз повторять запрос, получивший 429 Too Many Requests
+
+
+# Тексты вопросов анкеты
+QUESTIONS = (
+    "▫️️◾️️️◾️️️◾️️️◾◾️️️\n\n#1 – Оцените, насколько полезной была сегодняшняя встреча? \n(1 – не полезно, 2 – многое непонятно, 3 – нужно больше примеров, 4 – очень полезно, 5 – максимальная польза)",
+    "◻️▫️️◾️️️◾️️️◾️◾️️\n\n#2 – Насколько Вам понятен план действий до следующей встречи? \n(1 – слишком сложно, 2 – сложно, 3 – с усилием понятно, 4 – оптимально, 5 – очень легко)",
+    "◻️◻️▫️️◾️◾◾️️️️️️\n\n#3 – Оцените уровень экспертизы ментора по основной теме встречи. \n(1 – низкий уровень, 2 – ниже среднего, 3 – средний уровень, 4 – выше среднего, 5 – высокий уровень)",
+    "◻️◻️◻️▫️️◾️◾️️️️️\n\n#4 – Насколько эффективно Ваш трекер помогает Вам с решением ваших вопросов и проблем? \n(1 – не помог, 2 – иногда помогал, 3 – нормально, 4 – хорошо, 5 – отлично!)",
+    "◻️◻️◻️◻️▫️️◾️️️️\n\n#5 – Насколько быстро трекер Вам отвечает на ваши вопросы и обращения в рабочее время? \n(1 – несколько дней, 2 – через день, 3 – медленно отвечает, 4 – отвечает своевременно, 5 – отвечает быстро)",
+    "◻️◻️◻️◻️◻️▫️️️️️️\n\n#6 – Насколько занятие помогло вам продвинуться к поступлению и была ли информация полезной? \n(1 – не пригодится, 2 – мало практики, 3 – полезно, 4 – хорошая подготовка, 5 – отлично!)",
+)
+
+# Свойства базы отзывов в Notion и номера вопросов, ответы на которые в них записываются
+FEEDBACK_PROPERTIES = (
+    ("[1] USEFULNESS", 1),
+    ("[2] MATERIAL UNDERSTANDING", 2),
+    ("[3] EXPERTISE", 3),
+    ("[4] TRACKER", 4),
+    ("[5] QUICK RESPONSE", 5),
+    ("[6] IMPROVEMENT", 6),
+)
+
+# Смайлики для финального сообщения
+EMOJIS = (
+    "😊",  # Улыбающееся лицо
+    "😄",  # Широкая улыбка
+    "😃",  # Радостное лицо
+    "😆",  # Смеющееся лицо
+    "😇",  # Ангельское лицо
+    "😉",  # Подмигивающее лицо
+    "🤩",  # Звездные глаза
+    "🥳",  # Праздничное лицо
+    "😍",  # Влюбленные глаза
+    "🥰",  # Влюбленное лицо
+    "🙂",  # Слегка улыбающееся лицо
+    "🤗",  # Обнимающее лицо
+)
+
+
+class LRUCache:
+    """Словарь ограниченного размера, вытесняющий давно не использованные и устаревшие (старше ttl секунд) записи"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (время устаревания, значение)
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        expires_at, value = self._data[key]
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class TelegramAPIError(Exception):
+    """Ответ Telegram Bot API с ok = false; retry_after — рекомендуемая пауза в секундах, если Telegram её прислал"""
+
+    def __init__(self, description, retry_after=None):
+        super().__init__(description)
+        self.retry_after = retry_after
+
 
 class FeedbackBot:
     def __init__(self):
-        self.notion = Client(auth=NOTION_API_KEY)
+        self._session = None
+        # Ограничение числа встреч/напоминаний, обрабатываемых одновременно
+        self._batch_sem = asyncio.Semaphore(10)
+        # Ограничение числа запросов, одновременно выполняющихся к каждому API. Это не лимит в секунду:
+        # при ответах Notion ~200 мс три слота дают до ~15 запросов/с, превышение лимита Notion
+        # (в среднем 3 запроса/с) обрабатывается повтором по 429 в api_request
+        self._tg_sem = asyncio.Semaphore(20)
+        self._notion_sem = asyncio.Semaphore(3)
+        # Кэш данных Notion: mentor_id -> имя ментора
+        self._mentor_cache = LRUCache(NOTION_CACHE_SIZE, NOTION_CACHE_TTL)
+        # Незавершённые запросы имён менторов: mentor_id -> Task, общий для всех ожидающих
+        self._mentor_lookups = {}
+        # Одно соединение на всё время работы бота; autocommit, транзакции открываются явно
+        self._db = sqlite3.connect("feedback.db", isolation_level=None)
         self.init_database()
         logger.info("Бот инициализирован")
 
     def init_database(self):
         """Инициализация базы данных SQLite"""
-        with sqlite3.connect("feedback.db") as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS questionnaires (
-                    chat_id TEXT,
-                    meeting_id TEXT,
-                    meeting_name TEXT,
-                    student_id TEXT,  
-                    status TEXT,
-                    current_question INTEGER,
-                    answers TEXT,
-                    last_message_id TEXT,
-                    created_at TEXT,
-                    started_by TEXT,        
-                    filler_nickname TEXT,
-                    PRIMARY KEY (chat_id, meeting_id)
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS processed_meetings (
-                    meeting_id TEXT PRIMARY KEY
-                )
-            """)
-            conn.commit()
-            logger.info("База данных успешно инициализирована")
+        # WAL сохраняется в файле БД, остальные настройки действуют на соединение
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute("PRAGMA temp_store=MEMORY")
+        self._db.execute("PRAGMA cache_size=-20000")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS questionnaires (
+                chat_id TEXT,
+                meeting_id TEXT,
+                meeting_name TEXT,
+                student_id TEXT,  
+                status TEXT,
+                current_question INTEGER,
+                last_message_id TEXT,
+                created_at TEXT,
+                started_by TEXT,        
+                filler_nickname TEXT,
+                PRIMARY KEY (chat_id, meeting_id)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS processed_meetings (
+                meeting_id TEXT PRIMARY KEY
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                chat_id TEXT,
+                meeting_id TEXT,
+                question_num INTEGER,
+                points INTEGER,
+                PRIMARY KEY (chat_id, meeting_id, question_num)
+            )
+        """)
+        # Короткие числовые id анкет для callback_data (Telegram ограничивает её 64 байтами)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS q_short (
+                short_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT,
+                meeting_id TEXT,
+                UNIQUE (chat_id, meeting_id)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        # Индекс под выборку напоминаний по статусу. Он не покрывающий: meeting_name и last_message_id
+        # читаются из строки таблицы, зато по индексу обходятся только незавершённые анкеты
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_q_status ON questionnaires (status, chat_id)")
+        self._db.execute("ANALYZE")
+        logger.info("База данных успешно инициализирована")
+
+
+    async def _ensure_session(self):
+        """Создание общей HTTP-сессии для запросов к Telegram и Notion"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
 
+    async def aclose(self):
+        """Закрытие HTTP-сессии и соединения с базой данных"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._db.close()
+
+    @asynccontextmanager
+    async def api_request(self, semaphore, method, url, **kwargs):
+        """HTTP-запрос с ограничением параллелизма и повтором при ответе 429"""
+        for attempt in range(RATE_LIMIT_RETRIES):
+            async with semaphore:
+                response = await self._session.request(method, url, **kwargs)
+                if response.status != 429 or attempt == RATE_LIMIT_RETRIES - 1:
+                    try:
+                        yield response
+                    finally:
+                        response.release()
+                    return
+                retry_after = float(response.headers.get('Retry-After', 1))
+                response.release()
+            logger.warning(f"Превышен лимит запросов (429), повтор через {retry_after} с")
+            await asyncio.sleep(retry_after)
 
     async def start(self):
         """Запуск бота с фоновыми задачами"""
         logger.info("Запуск бота")
-        tasks = [
-            asyncio.create_task(self.run_notion_checker()),
-            asyncio.create_task(self.run_reminder_checker()),
-            asyncio.create_task(self.run_telegram_polling())
-        ]
-        await asyncio.gather(*tasks)
+        await self._ensure_session()
+        # При падении одной из задач TaskGroup отменяет остальные и бот завершается, поэтому каждый цикл
+        # сам перехватывает и логирует свои ошибки (except Exception) и продолжает работу; наружу выходят
+        # только отмена и ошибки запуска. Перезапуск процесса после такого выхода — задача супервизора
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.run_notion_checker())
+                tg.create_task(self.run_reminder_checker())
+                tg.create_task(self.run_telegram_polling())
+        finally:
+            await self.aclose()
 
     async def fetch_notion_meetings(self):
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28",
-            "Content-Type": "application/json"
-        }
         today = datetime.now().isoformat()
         fourteen_days_ago = (datetime.now() - timedelta(days=14)).isoformat()
 
@@ -98,26 +270,26 @@ class FeedbackBot:
         retries = 5
         for attempt in range(retries):
             try:
-                timeout = aiohttp.ClientTimeout(total=90)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.post(
-                            f"https://api.notion.com/v1/databases/{NOTION_MEETINGS_DB_ID}/query",
-                            headers=headers,
-                            json=payload,
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Notion API вернул ошибку: {response.status}, текст: {error_text}")
-                            return []
-
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'application/json' not in content_type:
-                            error_text = await response.text()
-                            logger.error(f"Неожиданный Content-Type: {content_type}, текст: {error_text}")
-                            return []
-
-                        data = await response.json()
-                        return data.get('results', [])
+                async with self.api_request(
+                        self._notion_sem, "POST",
+                        f"https://api.notion.com/v1/databases/{NOTION_MEETINGS_DB_ID}/query",
+                        headers=NOTION_HEADERS,
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=90)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"Notion API вернул ошибку: {response.status}, текст: {error_text}")
+                        return []
+
+                    content_type = response.headers.get('Content-Type', '')
+                    if 'application/json' not in content_type:
+                        error_text = await response.text()
+                        logger.error(f"Неожиданный Content-Type: {content_type}, текст: {error_text}")
+                        return []
+
+                    data = await response.json()
+                    return data.get('results', [])
             except Exception as e:
                 logger.error(f"Попытка {attempt + 1}/{retries} завершилась ошибкой: {e}")
                 if attempt == retries - 1:
@@ -125,131 +297,169 @@ class FeedbackBot:
                     return []
                 await asyncio.sleep(2 ** attempt)  # Экспоненциальная задержка
 
-    async def process_meeting(self, meeting):
-        properties = meeting.get('properties', {})  # Безопасный доступ к properties
-        meeting_id = meeting.get('id', '')
-
-        # Извлечение meeting_name
-        title_list = properties.get('Name', {}).get('title', [])
-        if not title_list or 'text' not in title_list[0]:
-            logger.error(f"Отсутствует название встречи для meeting_id {meeting_id}")
-            return
-        meeting_name = title_list[0]['text']['content']
-
-        # Извлечение mentor_relation
-        properties = meeting.get('properties', {})
-        mentor_relation_list = properties.get('Mentor(s)', {}).get('relation', [])
-        if not mentor_relation_list:
-            logger.error(f"Отсутствует ментор для meeting_id {meeting_id}")
-            return
-        mentor_relation = mentor_relation_list[0]['id']
-        mentor_name = await self.get_notion_page_name(mentor_relation)
-
-        # Извлечение student_id
-        student_relation_list = properties.get('Student', {}).get('relation', [])
-        if not student_relation_list:
-            logger.error(f"Отсутствует студент для meeting_id {meeting_id}")
-            return
-        student_id = student_relation_list[0]['id']
-
-        # Извлечение chat_id
-        chat_id_array = properties.get('TG_CHAT_ID', {}).get('rollup', {}).get('array', [])
-        if not chat_id_array:
-            logger.error(f"Отсутствует TG_CHAT_ID для meeting_id {meeting_id}")
-            return
-        chat_id = str(chat_id_array[0]['number'])
-
-        if self.is_meeting_processed(meeting_id):
-            return
+    def parse_meeting(self, meeting):
+        """
+        Извлечение полей встречи из ответа Notion до каких-либо сетевых запросов.
 
-        # Сохраняем анкету
-        self.save_questionnaire(chat_id, meeting_id, meeting_name, mentor_name, student_id)
-        logger.info(f"Сохранена новая анкета для chat_id {chat_id}, meeting_id {meeting_id}")
+        Встреча с неполными данными помечается обработанной, чтобы она не запрашивалась
+        и не падала повторно при каждой проверке.
 
-        # Отправляем начальное сообщение с обработкой ошибок
+        Returns:
+            tuple: (meeting_id, meeting_name, mentor_id, student_id, chat_id)
+                   или None, если данных встречи недостаточно.
+        """
+        meeting_id = meeting.get('id', '')
         try:
-            message_id = await self.send_initial_message(chat_id, meeting_name, mentor_name)
-            with sqlite3.connect("feedback.db") as conn:
-                conn.execute(
-                    "UPDATE questionnaires SET last_message_id = ? WHERE chat_id = ? AND meeting_id = ?",
-                    (message_id, chat_id, meeting_id)
-                )
-                conn.commit()
-        except Exception as e:
-            logger.error(
-                f"Ошибка при отправке начального сообщения для chat_id {chat_id}, meeting_id {meeting_id}: {e}")
-            # Удаляем запись из базы данных в случае ошибки
-            with sqlite3.connect("feedback.db") as conn:
-                conn.execute(
-                    "DELETE FROM questionnaires WHERE chat_id = ? AND meeting_id = ?",
-                    (chat_id, meeting_id)
-                )
-                conn.commit()
-            return
+            properties = meeting.get('properties', {})  # Безопасный доступ к properties
+
+            # Извлечение meeting_name
+            title_list = properties.get('Name', {}).get('title', [])
+            if not title_list or 'text' not in title_list[0]:
+                raise ValueError("отсутствует название встречи")
+            meeting_name = title_list[0]['text']['content']
+
+            # Извлечение mentor_relation
+            mentor_relation_list = properties.get('Mentor(s)', {}).get('relation', [])
+            if not mentor_relation_list:
+                raise ValueError("отсутствует ментор")
+            mentor_id = mentor_relation_list[0]['id']
+
+            # Извлечение student_id
+            student_relation_list = properties.get('Student', {}).get('relation', [])
+            if not student_relation_list:
+                raise ValueError("отсутствует студент")
+            student_id = student_relation_list[0]['id']
+
+            # Извлечение chat_id
+            chat_id_array = properties.get('TG_CHAT_ID', {}).get('rollup', {}).get('array', [])
+            if not chat_id_array or chat_id_array[0].get('number') is None:
+                raise ValueError("отсутствует TG_CHAT_ID")
+            chat_id = str(chat_id_array[0]['number'])
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            logger.error(f"Некорректные данные встречи meeting_id {meeting_id}: {e}, встреча пропущена")
+            if meeting_id:
+                self.mark_meeting_processed(meeting_id)
+            return None
+        return meeting_id, meeting_name, mentor_id, student_id, chat_id
+
+    async def process_meeting(self, meeting_id, meeting_name, mentor_id, student_id, chat_id, mentor_names):
+        async with self._batch_sem:
+            mentor_name = mentor_names[mentor_id]
+            if isinstance(mentor_name, Exception):
+                raise mentor_name
+
+            # Отправляем начальное сообщение с обработкой ошибок
+            try:
+                message_id = await self.send_initial_message(chat_id, meeting_id, meeting_name, mentor_name)
+            except Exception as e:
+                logger.error(
+                    f"Ошибка при отправке начального сообщения для chat_id {chat_id}, meeting_id {meeting_id}: {e}")
+                # Короткий id создаётся до отправки; без анкеты он никогда не будет удалён
+                self.delete_short_id(chat_id, meeting_id)
+                return
 
-        # Отмечаем встречу как обработанную
-        self.mark_meeting_processed(meeting_id)
+            # Сохраняем анкету сразу с last_message_id и отмечаем встречу как обработанную
+            with self.transaction():
+                self.save_questionnaire(chat_id, meeting_id, meeting_name, mentor_name, student_id, message_id)
+                self.mark_meeting_processed(meeting_id)
+            logger.info(f"Сохранена новая анкета для chat_id {chat_id}, meeting_id {meeting_id}")
+
+    async def get_mentor_name(self, mentor_id):
+        """Получение имени ментора с использованием кэша"""
+        mentor_name = self._mentor_cache.get(mentor_id)
+        if mentor_name is not None:
+            return mentor_name
+        # Одновременные промахи по одному ментору (например, напоминания) ждут один общий запрос
+        lookup = self._mentor_lookups.get(mentor_id)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self.fetch_mentor_name(mentor_id))
+            self._mentor_lookups[mentor_id] = lookup
+            lookup.add_done_callback(lambda _: self._mentor_lookups.pop(mentor_id, None))
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(lookup)
+
+    async def fetch_mentor_name(self, mentor_id):
+        """Запрос имени ментора из Notion с сохранением в кэш"""
+        mentor_name = await self.get_notion_page_name(mentor_id)
+        self._mentor_cache.put(mentor_id, mentor_name)
+        return mentor_name
 
     async def get_notion_page_name(self, page_id):
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28"
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                    f"https://api.notion.com/v1/pages/{page_id}",
-                    headers=headers
-            ) as response:
-                data = await response.json()
-                #logger.debug(f"Ответ от Notion API для page_id {page_id}: {data}")
-                if response.status != 200:
-                    logger.error(f"Ошибка API Notion: статус {response.status}, данные: {data}")
-                    raise Exception(f"Ошибка API Notion: {data.get('message', 'Неизвестная ошибка')}")
-                if 'properties' not in data or 'Name' not in data['properties']:
-                    logger.error(f"Неверный ответ для page_id {page_id}")
-                    raise KeyError("Неверный ответ Notion API для страницы")
-                return data['properties']['Name']['title'][0]['text']['content']
+        async with self.api_request(
+                self._notion_sem, "GET",
+                f"https://api.notion.com/v1/pages/{page_id}",
+                headers=NOTION_GET_HEADERS
+        ) as response:
+            data = await response.json()
+            #logger.debug(f"Ответ от Notion API для page_id {page_id}: {data}")
+            if response.status != 200:
+                logger.error(f"Ошибка API Notion: статус {response.status}, данные: {data}")
+                raise Exception(f"Ошибка API Notion: {data.get('message', 'Неизвестная ошибка')}")
+            if 'properties' not in data or 'Name' not in data['properties']:
+                logger.error(f"Неверный ответ для page_id {page_id}")
+                raise KeyError("Неверный ответ Notion API для страницы")
+            return data['properties']['Name']['title'][0]['text']['content']
+
+    @contextmanager
+    def transaction(self):
+        """Явная транзакция на общем соединении: COMMIT при успехе, ROLLBACK при ошибке"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def get_bot_state(self, key, default=None):
+        """Чтение сохранённого значения состояния бота"""
+        row = self._db.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_bot_state(self, key, value):
+        """Сохранение значения состояния бота"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+            (key, str(value))
+        )
 
     def is_meeting_processed(self, meeting_id):
         """Проверка, обработана ли встреча"""
-        with sqlite3.connect("feedback.db") as conn:
-            cursor = conn.execute(
-                "SELECT 1 FROM processed_meetings WHERE meeting_id = ?",
-                (meeting_id,)
-            )
-            return cursor.fetchone() is not None
+        cursor = self._db.execute(
+            "SELECT 1 FROM processed_meetings WHERE meeting_id = ?",
+            (meeting_id,)
+        )
+        return cursor.fetchone() is not None
 
     def mark_meeting_processed(self, meeting_id):
         """Отметка встречи как обработанной"""
-        with sqlite3.connect("feedback.db") as conn:
-            conn.execute(
-                "INSERT INTO processed_meetings (meeting_id) VALUES (?)",
-                (meeting_id,)
-            )
-            conn.commit()
-
-    def save_questionnaire(self, chat_id, meeting_id, meeting_name, mentor_name, student_id):
-        with sqlite3.connect("feedback.db") as conn:
-            conn.execute("""
-                INSERT INTO questionnaires 
-                (chat_id, meeting_id, meeting_name, student_id, status, current_question, answers, created_at)
-                VALUES (?, ?, ?, ?, 'pending', 0, '{}', ?)
-            """, (chat_id, meeting_id, meeting_name, student_id, datetime.now().isoformat()))
-            conn.commit()
-
-    async def send_initial_message(self, chat_id, meeting_name, mentor_name):
+        self._db.execute(
+            "INSERT INTO processed_meetings (meeting_id) VALUES (?) ON CONFLICT (meeting_id) DO NOTHING",
+            (meeting_id,)
+        )
+
+    def save_questionnaire(self, chat_id, meeting_id, meeting_name, mentor_name, student_id, last_message_id=None):
+        self._db.execute("""
+            INSERT INTO questionnaires 
+            (chat_id, meeting_id, meeting_name, student_id, status, current_question, last_message_id, created_at)
+            VALUES (?, ?, ?, ?, 'pending', 0, ?, ?)
+            ON CONFLICT (chat_id, meeting_id) DO NOTHING
+        """, (chat_id, meeting_id, meeting_name, student_id, last_message_id, datetime.now().isoformat()))
+
+    async def send_initial_message(self, chat_id, meeting_id, meeting_name, mentor_name):
         """Отправка начального сообщения с кнопкой 'Начать'"""
 
         # Получаем дату встречи
-        finalDate = await self.get_meeting_date(meeting_name)
+        finalDate = await self.get_meeting_date(meeting_id)
         if finalDate is None:
             finalDate = "Неизвестная дата"  # Значение по умолчанию при ошибке
 
 
+        short_id = self.get_short_id(chat_id, meeting_id)
         keyboard = {
             "inline_keyboard": [[{
                 "text": "⏭️ Продолжить (нажимает клиент)",
-                "callback_data": f"start,{chat_id},{meeting_name}"
+                "callback_data": f"s,{short_id}"
             }]]
         }
         message_text = (
@@ -258,61 +468,41 @@ class FeedbackBot:
         message = await self.send_telegram_message(chat_id, message_text, keyboard)
         return message['result']['message_id']
 
-    async def get_meeting_date(self, meeting_name):
+    async def get_meeting_date(self, meeting_id):
         """
-        Получение даты встречи из Notion по названию встречи (meeting_name).
-        Функция сначала находит meeting_id в таблице questionnaires на основе meeting_name,
-        затем выполняет запрос к Notion API для получения даты встречи.
+        Получение даты встречи из Notion по идентификатору страницы встречи (meeting_id).
 
         Args:
-            meeting_name (str): Название встречи, по которому нужно найти дату.
+            meeting_id (str): Идентификатор страницы встречи в Notion.
 
         Returns:
             str: Дата встречи в формате, возвращаемом Notion API (например, "2025-02-23"),
                  или None, если дата не найдена или произошла ошибка.
         """
-        # Подключаемся к базе данных SQLite и ищем meeting_id по meeting_name
-        with sqlite3.connect("feedback.db") as conn:
-            cursor = conn.execute(
-                "SELECT meeting_id FROM questionnaires WHERE meeting_name = ?",
-                (meeting_name,)
-            )
-            row = cursor.fetchone()
-            if not row:
-                logger.error(f"Встреча с названием {meeting_name} не найдена в базе данных")
+        # Выполняем асинхронный запрос к Notion API
+        async with self.api_request(
+                self._notion_sem, "GET",
+                f"https://api.notion.com/v1/pages/{meeting_id}",
+                headers=NOTION_GET_HEADERS
+        ) as response:
+            if response.status != 200:
+                error_data = await response.json()
+                logger.error(f"Ошибка API Notion при получении даты встречи: {error_data}")
                 return None
-            meeting_id = row[0]
 
-        # Формируем заголовки для запроса к Notion API
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28"
-        }
+            # Получаем данные из ответа
+            data = await response.json()
+            if 'properties' not in data or 'Date' not in data['properties']:
+                logger.error(f"Свойство 'Date' не найдено для meeting_id {meeting_id}")
+                return None
 
-        # Выполняем асинхронный запрос к Notion API
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                    f"https://api.notion.com/v1/pages/{meeting_id}",
-                    headers=headers
-            ) as response:
-                if response.status != 200:
-                    error_data = await response.json()
-                    logger.error(f"Ошибка API Notion при получении даты встречи: {error_data}")
-                    return None
-
-                # Получаем данные из ответа
-                data = await response.json()
-                if 'properties' not in data or 'Date' not in data['properties']:
-                    logger.error(f"Свойство 'Date' не найдено для meeting_id {meeting_id}")
-                    return None
-
-                # Извлекаем дату из свойства 'Date'
-                date_property = data['properties']['Date']
-                if date_property['type'] == 'date' and 'start' in date_property['date']:
-                    return date_property['date']['start']
-                else:
-                    logger.error(f"Неверный формат даты для meeting_id {meeting_id}")
-                    return None
+            # Извлекаем дату из свойства 'Date'
+            date_property = data['properties']['Date']
+            if date_property['type'] == 'date' and 'start' in date_property['date']:
+                return date_property['date']['start']
+            else:
+                logger.error(f"Неверный формат даты для meeting_id {meeting_id}")
+                return None
 
     async def send_telegram_message(self, chat_id, text, keyboard=None):
         """Отправка сообщения в Telegram"""
@@ -324,151 +514,154 @@ class FeedbackBot:
         }
         if keyboard:
             payload['reply_markup'] = json.dumps(keyboard)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                return await response.json()
+        async with self.api_request(self._tg_sem, "POST", url, json=payload) as response:
+            return await response.json()
+
+    def get_short_id(self, chat_id, meeting_id):
+        """Получение (или создание) короткого id анкеты для callback_data"""
+        self._db.execute(
+            "INSERT OR IGNORE INTO q_short (chat_id, meeting_id) VALUES (?, ?)",
+            (chat_id, meeting_id)
+        )
+        cursor = self._db.execute(
+            "SELECT short_id FROM q_short WHERE chat_id = ? AND meeting_id = ?",
+            (chat_id, meeting_id)
+        )
+        return cursor.fetchone()[0]
+
+    def delete_short_id(self, chat_id, meeting_id):
+        """Удаление короткого id анкеты"""
+        self._db.execute(
+            "DELETE FROM q_short WHERE chat_id = ? AND meeting_id = ?",
+            (chat_id, meeting_id)
+        )
+
+    def resolve_short_id(self, short_id):
+        """Получение (chat_id, meeting_id) по короткому id анкеты или None"""
+        cursor = self._db.execute(
+            "SELECT chat_id, meeting_id FROM q_short WHERE short_id = ?",
+            (short_id,)
+        )
+        return cursor.fetchone()
 
     async def handle_callback_query(self, callback_query):
-        """Обработка callback_query"""
+        """Обработка callback_query: 's,<short_id>' — начало анкеты, 'a,<short_id>,<вопрос>,<оценка>' — ответ"""
         data = callback_query['data'].split(',')
         action = data[0]
+        if action not in ("s", "a"):
+            logger.warning(f"Неизвестный callback_data: {callback_query['data']}")
+            return
+
+        short_id = int(data[1])
+        questionnaire = self.resolve_short_id(short_id)
+        if questionnaire is None:
+            logger.warning(f"Анкета с short_id {short_id} не найдена")
+            return
+        chat_id, meeting_id = questionnaire
 
-        if action == "start":
-            chat_id = data[1]
-            meeting_name = data[2] if len(data) > 2 else ""
+        if action == "s":
             user_id = callback_query['from']['id']  # Получаем Telegram user_id
             user_nickname = callback_query['from'].get('username', callback_query['from'].get('first_name',
                                                                                               'Unknown'))  # Никнейм или имя
-            await self.start_questionnaire(chat_id, meeting_name, callback_query['message']['message_id'], user_id,
-                                           user_nickname)
-        elif action == "answer":
-            chat_id = data[1]
-            meeting_id = data[2]
-            question_num = int(data[3])
-            points = int(data[4])
+            await self.start_questionnaire(chat_id, meeting_id, short_id, callback_query['message']['message_id'],
+                                           user_id, user_nickname)
+        else:
+            question_num = int(data[2])
+            points = int(data[3])
             user_id = callback_query['from']['id']  # Получаем user_id для проверки
-            await self.process_answer(chat_id, question_num, points, callback_query['message']['message_id'], user_id, callback_query['id'])
+            await self.process_answer(chat_id, meeting_id, short_id, question_num, points,
+                                      callback_query['message']['message_id'], user_id, callback_query['id'])
 
-    async def start_questionnaire(self, chat_id, meeting_name, message_id, user_id, user_nickname):
+    async def start_questionnaire(self, chat_id, meeting_id, short_id, message_id, user_id, user_nickname):
         """Начало анкеты: отправка первого вопроса"""
-        with sqlite3.connect("feedback.db") as conn:
-            cursor = conn.execute(
-                "SELECT meeting_id FROM questionnaires WHERE chat_id = ? AND status = 'pending' LIMIT 1",
-                (chat_id,)
-            )
-            row = cursor.fetchone()
-            if row:
-                meeting_id = row[0]
-                conn.execute(
-                    "UPDATE questionnaires SET status = 'in_progress', current_question = 1, started_by = ?, filler_nickname = ? WHERE chat_id = ? AND meeting_id = ?",
-                    (user_id, user_nickname, chat_id, meeting_id)
-                )
-                conn.commit()
-                keyboard = self.generate_question_keyboard(1, chat_id, meeting_id)
-                question_text = self.get_question_text(1)
-                await self.edit_telegram_message(chat_id, message_id, question_text, keyboard)
+        # Проверка статуса и перевод в in_progress одним запросом
+        cursor = self._db.execute(
+            "UPDATE questionnaires SET status = 'in_progress', current_question = 1, started_by = ?, filler_nickname = ? WHERE chat_id = ? AND meeting_id = ? AND status = 'pending'",
+            (user_id, user_nickname, chat_id, meeting_id)
+        )
+        if cursor.rowcount:
+            keyboard = self.generate_question_keyboard(1, short_id)
+            question_text = self.get_question_text(1)
+            await self.edit_telegram_message(chat_id, message_id, question_text, keyboard)
 
     def update_questionnaire_status(self, chat_id, meeting_id, status, current_question):
         """Обновление статуса анкеты"""
-        with sqlite3.connect("feedback.db") as conn:
-            conn.execute(
-                "UPDATE questionnaires SET status = ?, current_question = ? WHERE chat_id = ? AND meeting_id = ?",
-                (status, current_question, chat_id, meeting_id)
-            )
-            conn.commit()
+        self._db.execute(
+            "UPDATE questionnaires SET status = ?, current_question = ? WHERE chat_id = ? AND meeting_id = ?",
+            (status, current_question, chat_id, meeting_id)
+        )
 
-    def generate_question_keyboard(self, question_num, chat_id, meeting_id):
+    def generate_question_keyboard(self, question_num, short_id):
         """Генерация клавиатуры для вопроса"""
         return {
             "inline_keyboard": [[
-                {"text": f"{i} ⭐️", "callback_data": f"answer,{chat_id},{meeting_id},{question_num},{i}"}
+                {"text": f"{i} ⭐️", "callback_data": f"a,{short_id},{question_num},{i}"}
                 for i in range(1, 6)
             ]]
         }
 
     def get_question_text(self, question_num):
         """Получение текста вопроса"""
-        questions = [
-            "▫️️◾️️️◾️️️◾️️️◾◾️️️\n\n#1 – Оцените, насколько полезной была сегодняшняя встреча? \n(1 – не полезно, 2 – многое непонятно, 3 – нужно больше примеров, 4 – очень полезно, 5 – максимальная польза)",
-            "◻️▫️️◾️️️◾️️️◾️◾️️\n\n#2 – Насколько Вам понятен план действий до следующей встречи? \n(1 – слишком сложно, 2 – сложно, 3 – с усилием понятно, 4 – оптимально, 5 – очень легко)",
-            "◻️◻️▫️️◾️◾◾️️️️️️\n\n#3 – Оцените уровень экспертизы ментора по основной теме встречи. \n(1 – низкий уровень, 2 – ниже среднего, 3 – средний уровень, 4 – выше среднего, 5 – высокий уровень)",
-            "◻️◻️◻️▫️️◾️◾️️️️️\n\n#4 – Насколько эффективно Ваш трекер помогает Вам с решением ваших вопросов и проблем? \n(1 – не помог, 2 – иногда помогал, 3 – нормально, 4 – хорошо, 5 – отлично!)",
-            "◻️◻️◻️◻️▫️️◾️️️️\n\n#5 – Насколько быстро трекер Вам отвечает на ваши вопросы и обращения в рабочее время? \n(1 – несколько дней, 2 – через день, 3 – медленно отвечает, 4 – отвечает своевременно, 5 – отвечает быстро)",
-            "◻️◻️◻️◻️◻️▫️️️️️️\n\n#6 – Насколько занятие помогло вам продвинуться к поступлению и была ли информация полезной? \n(1 – не пригодится, 2 – мало практики, 3 – полезно, 4 – хорошая подготовка, 5 – отлично!)"
-        ]
-        return questions[question_num - 1]
-
-    async def process_answer(self, chat_id, question_num, points, message_id, user_id, callback_query_id):
-        with (sqlite3.connect("feedback.db") as conn):
-            cursor = conn.execute(
-                "SELECT meeting_id, answers, current_question, started_by, meeting_name, filler_nickname FROM questionnaires WHERE chat_id = ? AND status = 'in_progress'",
-                (chat_id,)
-            )
-            row = cursor.fetchone()
-            if row:
-                meeting_id, answers_json, current_question, started_by, meeting_name, filler_nickname = row
-                if str(user_id) != started_by:
-                    alert_text = f"You are not the person filling in the questionnaire {filler_nickname}"
-                    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/answerCallbackQuery"
-                    payload = {
-                        'callback_query_id': callback_query_id,
-                        'text': alert_text,
-                        'show_alert': True
-                    }
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(url, json=payload) as response:
-                            await response.json()
-                    return
-                answers = json.loads(answers_json) if answers_json else {}
-                answers[question_num] = points
-                logger.info(f"Сохранен ответ на вопрос {question_num}: {points} для meeting_id {meeting_id}")
+        return QUESTIONS[question_num - 1]
 
-                next_question = current_question + 1
-                total_questions = 6
-                if next_question <= total_questions:
-                    conn.execute(
-                        "UPDATE questionnaires SET answers = ?, current_question = ? WHERE chat_id = ? AND meeting_id = ?",
-                        (json.dumps(answers), next_question, chat_id, meeting_id)
+    async def process_answer(self, chat_id, meeting_id, short_id, question_num, points, message_id, user_id, callback_query_id):
+        cursor = self._db.execute(
+            "SELECT current_question, started_by, meeting_name, filler_nickname FROM questionnaires WHERE chat_id = ? AND meeting_id = ? AND status = 'in_progress'",
+            (chat_id, meeting_id)
+        )
+        row = cursor.fetchone()
+        if row:
+            current_question, started_by, meeting_name, filler_nickname = row
+            if str(user_id) != started_by:
+                alert_text = f"You are not the person filling in the questionnaire {filler_nickname}"
+                url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/answerCallbackQuery"
+                payload = {
+                    'callback_query_id': callback_query_id,
+                    'text': alert_text,
+                    'show_alert': True
+                }
+                async with self.api_request(self._tg_sem, "POST", url, json=payload) as response:
+                    await response.json()
+                return
+            # Повторное нажатие на клавиатуру уже отвеченного вопроса не должно сдвигать анкету
+            if question_num != current_question:
+                logger.warning(f"Игнорируем ответ на вопрос {question_num}: текущий вопрос {current_question}, meeting_id {meeting_id}")
+                return
+            next_question = current_question + 1
+            total_questions = len(QUESTIONS)
+            if next_question <= total_questions:
+                with self.transaction():
+                    self.save_answer(chat_id, meeting_id, question_num, points)
+                    self._db.execute(
+                        "UPDATE questionnaires SET current_question = ? WHERE chat_id = ? AND meeting_id = ?",
+                        (next_question, chat_id, meeting_id)
                     )
-                    conn.commit()
-                    keyboard = self.generate_question_keyboard(next_question, chat_id, meeting_id)
-                    question_text = self.get_question_text(next_question)
-                    await self.edit_telegram_message(chat_id, message_id, question_text, keyboard)
-                else:
-                    conn.execute(
-                        "UPDATE questionnaires SET answers = ?, status = 'completed', current_question = ? WHERE chat_id = ? AND meeting_id = ?",
-                        (json.dumps(answers), next_question, chat_id, meeting_id)
+                logger.info(f"Сохранен ответ на вопрос {question_num}: {points} для meeting_id {meeting_id}")
+                keyboard = self.generate_question_keyboard(next_question, short_id)
+                question_text = self.get_question_text(next_question)
+                await self.edit_telegram_message(chat_id, message_id, question_text, keyboard)
+            else:
+                with self.transaction():
+                    self.save_answer(chat_id, meeting_id, question_num, points)
+                    self._db.execute(
+                        "UPDATE questionnaires SET status = 'completed', current_question = ? WHERE chat_id = ? AND meeting_id = ?",
+                        (next_question, chat_id, meeting_id)
                     )
-                    conn.commit()
-                    summary = await self.get_meeting_summary(meeting_id)
-
-                    emojis = [
-                        "😊",  # Улыбающееся лицо
-                        "😄",  # Широкая улыбка
-                        "😃",  # Радостное лицо
-                        "😆",  # Смеющееся лицо
-                        "😇",  # Ангельское лицо
-                        "😉",  # Подмигивающее лицо
-                        "🤩",  # Звездные глаза
-                        "🥳",  # Праздничное лицо
-                        "😍",  # Влюбленные глаза
-                        "🥰",  # Влюбленное лицо
-                        "🙂",  # Слегка улыбающееся лицо
-                        "🤗"  # Обнимающее лицо
-                    ]
-                    random_emoji = random.choice(emojis)  # Выбираем случайный смайлик
-                    # Добавляем получение имени ментора
-                    mentor_name = await self.get_mentor_name_from_notion(meeting_id)
-                    summary = await self.get_meeting_summary(meeting_id)
-                    if summary is not None and (
-                            ("No content" not in summary or len(summary) > 50) and len(summary) > 0):
-                        summary = f"📄 Meeting Summary\n————————\n{summary}"
-                    else:
-                        summary = ""
-                    final_message = f"Вы успешно заполнили анкету обратной связи на встречу {meeting_name} с ментором {mentor_name}! Спасибо, что ответили на все вопросы {random_emoji}\n\n<b>>> Заполнил(-а): {filler_nickname}</b> \n\n{summary}"
-                    await self.edit_telegram_message(chat_id, message_id, final_message)
-                    await self.save_feedback_to_notion(chat_id, meeting_id, answers)
-                    await self.mark_notion_meeting_completed(meeting_id)
+                logger.info(f"Сохранен ответ на вопрос {question_num}: {points} для meeting_id {meeting_id}")
+
+                random_emoji = random.choice(EMOJIS)  # Выбираем случайный смайлик
+                # Добавляем получение имени ментора
+                mentor_name = await self.get_mentor_name_from_notion(meeting_id)
+                summary = await self.get_meeting_summary(meeting_id)
+                if summary is not None and (
+                        ("No content" not in summary or len(summary) > 50) and len(summary) > 0):
+                    summary = f"📄 Meeting Summary\n————————\n{summary}"
+                else:
+                    summary = ""
+                final_message = f"Вы успешно заполнили анкету обратной связи на встречу {meeting_name} с ментором {mentor_name}! Спасибо, что ответили на все вопросы {random_emoji}\n\n<b>>> Заполнил(-а): {filler_nickname}</b> \n\n{summary}"
+                await self.edit_telegram_message(chat_id, message_id, final_message)
+                await self.save_feedback_to_notion(chat_id, meeting_id)
+                await self.mark_notion_meeting_completed(meeting_id)
 
 
 
@@ -484,73 +677,101 @@ class FeedbackBot:
         }
         if keyboard:
             payload['reply_markup'] = json.dumps(keyboard)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                return await response.json()
-
-    async def save_feedback_to_notion(self, chat_id, meeting_id, answers):
-        with sqlite3.connect("feedback.db") as conn:
-            cursor = conn.execute(
-                "SELECT student_id, meeting_name, filler_nickname FROM questionnaires WHERE chat_id = ? AND meeting_id = ?",
-                (chat_id, meeting_id)
-            )
-            row = cursor.fetchone()
-            if not row:
-                logger.error(f"Анкета для chat_id {chat_id} и meeting_id {meeting_id} не найдена")
-                return
-            student_id, meeting_name, filler_nickname = row
+        async with self.api_request(self._tg_sem, "POST", url, json=payload) as response:
+            return await response.json()
+
+    def save_answer(self, chat_id, meeting_id, question_num, points):
+        """Сохранение ответа на один вопрос анкеты"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (chat_id, meeting_id, question_num, points) VALUES (?, ?, ?, ?)",
+            (chat_id, meeting_id, question_num, points)
+        )
+
+    def get_answers(self, chat_id, meeting_id):
+        """Ответы анкеты в виде {номер вопроса: оценка}"""
+        cursor = self._db.execute(
+            "SELECT question_num, points FROM answers WHERE chat_id = ? AND meeting_id = ?",
+            (chat_id, meeting_id)
+        )
+        return dict(cursor.fetchall())
+
+    async def save_feedback_to_notion(self, chat_id, meeting_id):
+        cursor = self._db.execute(
+            "SELECT student_id, meeting_name, filler_nickname FROM questionnaires WHERE chat_id = ? AND meeting_id = ?",
+            (chat_id, meeting_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            logger.error(f"Анкета для chat_id {chat_id} и meeting_id {meeting_id} не найдена")
+            return
+        student_id, meeting_name, filler_nickname = row
+        answers = self.get_answers(chat_id, meeting_id)
 
         feedback_data = {
             "parent": {"database_id": NOTION_FEEDBACK_DB_ID},
             "properties": {
                 "Meeting": {"relation": [{"id": meeting_id}]},
                 "Student": {"relation": [{"id": student_id}]},
-                "[1] USEFULNESS": {"number": answers.get('1', 0)},
-                "[2] MATERIAL UNDERSTANDING": {"number": answers.get('2', 0)},
-                "[3] EXPERTISE": {"number": answers.get('3', 0)},
-                "[4] TRACKER": {"number": answers.get('4', 0)},
-                "[5] QUICK RESPONSE": {"number": answers.get('5', 0)},
-                "[6] IMPROVEMENT": {"number": answers.get(6, 0)},
+                **{
+                    property_name: {"number": answers.get(question_num, 0)}
+                    for property_name, question_num in FEEDBACK_PROPERTIES
+                },
                 "Filler Name": {"rich_text": [{"text": {"content": filler_nickname or "Unknown"}}]},
                 "Date": {"date": {"start": datetime.now().isoformat()}},
                 #"Meeting Name": {"title": [{"text": {"content": meeting_name}}]},
                 "TG_CHAT_ID": {"title": [{"text": {"content": chat_id}}]}
             }
         }
-        response = self.notion.pages.create(**feedback_data)
+        response = await self.create_notion_page(feedback_data)
         logger.info(f"Feedback saved to Notion: {response}")
 
+    async def create_notion_page(self, payload):
+        """Создание страницы в Notion"""
+        async with self.api_request(
+                self._notion_sem, "POST",
+                "https://api.notion.com/v1/pages",
+                headers=NOTION_HEADERS,
+                json=payload
+        ) as response:
+            data = await response.json()
+            if response.status != 200:
+                logger.error(f"Ошибка API Notion при создании страницы: статус {response.status}, данные: {data}")
+                raise Exception(f"Ошибка API Notion: {data.get('message', 'Неизвестная ошибка')}")
+            return data
+
     async def mark_notion_meeting_completed(self, meeting_id):
         """Отметка встречи как обработанной в Notion"""
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28",
-            "Content-Type": "application/json"
-        }
         payload = {
             "properties": {
                 "BOT Feedback Received": {"checkbox": True}
             }
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.patch(
-                    f"https://api.notion.com/v1/pages/{meeting_id}",
-                    headers=headers,
-                    json=payload
-            ) as response:
-                if response.status != 200:
-                    error_data = await response.json()
-                    logger.error(f"Ошибка обновления встречи: {error_data}")
-            try:
-                with sqlite3.connect("feedback.db") as conn:
-                    conn.execute(
-                        "DELETE FROM questionnaires WHERE meeting_id = ?",
-                        (meeting_id,)
-                    )
-                    conn.commit()
-                    logger.info(f"Удалена запись из questionnaires для meeting_id {meeting_id}")
-            except sqlite3.Error as e:
-                logger.error(f"Ошибка удаления из questionnaires: {e}")
+        async with self.api_request(
+                self._notion_sem, "PATCH",
+                f"https://api.notion.com/v1/pages/{meeting_id}",
+                headers=NOTION_HEADERS,
+                json=payload
+        ) as response:
+            if response.status != 200:
+                error_data = await response.json()
+                logger.error(f"Ошибка обновления встречи: {error_data}")
+        try:
+            with self.transaction():
+                self._db.execute(
+                    "DELETE FROM questionnaires WHERE meeting_id = ?",
+                    (meeting_id,)
+                )
+                self._db.execute(
+                    "DELETE FROM answers WHERE meeting_id = ?",
+                    (meeting_id,)
+                )
+                self._db.execute(
+                    "DELETE FROM q_short WHERE meeting_id = ?",
+                    (meeting_id,)
+                )
+            logger.info(f"Удалена запись из questionnaires для meeting_id {meeting_id}")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка удаления из questionnaires: {e}")
 
     async def run_notion_checker(self):
         """Фоновая проверка завершенных встреч"""
@@ -560,8 +781,25 @@ class FeedbackBot:
             try:
                 meetings = await self.fetch_notion_meetings()
                 logger.info(f"Найдено {len(meetings)} встреч для обработки")
-                for meeting in meetings:
-                    await self.process_meeting(meeting)
+                # Уже обработанные встречи отсекаем до запросов к Notion
+                meetings = [m for m in meetings if not self.is_meeting_processed(m.get('id', ''))]
+                # Некорректные встречи отбрасываются (и помечаются обработанными) до сетевых запросов
+                meetings = [fields for fields in map(self.parse_meeting, meetings) if fields is not None]
+
+                # Имена менторов запрашиваем один раз на каждого уникального ментора
+                mentor_ids = list({mentor_id for _, _, mentor_id, _, _ in meetings})
+                mentor_names = dict(zip(mentor_ids, await asyncio.gather(
+                    *(self.get_mentor_name(mentor_id) for mentor_id in mentor_ids),
+                    return_exceptions=True
+                )))
+
+                results = await asyncio.gather(
+                    *(self.process_meeting(*fields, mentor_names) for fields in meetings),
+                    return_exceptions=True
+                )
+                for (meeting_id, *_), result in zip(meetings, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Ошибка обработки встречи {meeting_id}: {result}")
             except Exception as e:
                 logger.error(f"Ошибка в notion_checker: {e}")
 
@@ -571,70 +809,108 @@ class FeedbackBot:
         """Фоновая отправка напоминаний"""
         while True:
             try:
-                with sqlite3.connect("feedback.db") as conn:
-                    cursor = conn.execute(
-                        "SELECT chat_id, meeting_id, meeting_name, last_message_id FROM questionnaires WHERE status in ('pending', 'in_progress')"
-                    )
-                    pending = cursor.fetchall()
-                    logger.info(f"Найдено {len(pending)} анкет со статусом 'pending' или 'in_progress'")
-                    for chat_id, meeting_id, meeting_name, last_message_id in pending:
-                        if last_message_id:
-                            await self.delete_telegram_message(chat_id, last_message_id)
-                        # Получаем имя ментора из Notion по meeting_id
-                        mentor_name = await self.get_mentor_name_from_notion(meeting_id)
-                        # Сбрасываем поля started_by и filler_nickname в NULL
-                        conn.execute(
-                            "UPDATE questionnaires SET started_by = NULL, filler_nickname = NULL, status = 'pending', answers = '{}' WHERE chat_id = ? AND meeting_id = ?",
-                            (chat_id, meeting_id)
+                cursor = self._db.execute(
+                    "SELECT chat_id, meeting_id, meeting_name, last_message_id FROM questionnaires WHERE status in ('pending', 'in_progress')"
+                )
+                pending = cursor.fetchall()
+                logger.info(f"Найдено {len(pending)} анкет со статусом 'pending' или 'in_progress'")
+                if pending:
+                    # Сбрасываем поля started_by и filler_nickname в NULL и удаляем ответы одной транзакцией
+                    keys = [(chat_id, meeting_id) for chat_id, meeting_id, _, _ in pending]
+                    with self.transaction():
+                        self._db.executemany(
+                            "UPDATE questionnaires SET started_by = NULL, filler_nickname = NULL, status = 'pending' WHERE chat_id = ? AND meeting_id = ?",
+                            keys
+                        )
+                        self._db.executemany(
+                            "DELETE FROM answers WHERE chat_id = ? AND meeting_id = ?",
+                            keys
                         )
-                        # Отправляем сообщение с реальными meeting_name и mentor_name
-                        message_id = await self.send_initial_message(chat_id, meeting_name, mentor_name)
-                        # Обновляем last_message_id
-                        conn.execute(
+
+                results = await asyncio.gather(
+                    *(self.send_reminder(*row) for row in pending),
+                    return_exceptions=True
+                )
+                sent = []
+                for (chat_id, meeting_id, _, _), result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Ошибка отправки напоминания для chat_id {chat_id}, meeting_id {meeting_id}: {result}")
+                    else:
+                        sent.append(result)
+
+                # Обновляем last_message_id всех отправленных напоминаний одной транзакцией
+                if sent:
+                    with self.transaction():
+                        self._db.executemany(
                             "UPDATE questionnaires SET last_message_id = ? WHERE chat_id = ? AND meeting_id = ?",
-                            (message_id, chat_id, meeting_id)
+                            sent
                         )
-                        conn.commit()
             except Exception as e:
                 logger.error(f"Ошибка в reminder_checker: {e}")
             await asyncio.sleep(REMINDER_INTERVAL)
 
+    async def send_reminder(self, chat_id, meeting_id, meeting_name, last_message_id):
+        """
+        Повторная отправка приглашения заполнить анкету.
+
+        Returns:
+            tuple: (message_id, chat_id, meeting_id) для обновления last_message_id.
+        """
+        async with self._batch_sem:
+            if last_message_id:
+                await self.delete_telegram_message(chat_id, last_message_id)
+            # Получаем имя ментора из Notion по meeting_id
+            mentor_name = await self.get_mentor_name_from_notion(meeting_id)
+            # Отправляем сообщение с реальными meeting_name и mentor_name
+            message_id = await self.send_initial_message(chat_id, meeting_id, meeting_name, mentor_name)
+            return message_id, chat_id, meeting_id
+
     async def get_mentor_name_from_notion(self, meeting_id):
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28"
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                    f"https://api.notion.com/v1/pages/{meeting_id}",
-                    headers=headers
-            ) as response:
-                data = await response.json()
-                #logger.debug(f"Ответ от Notion API для meeting_id {meeting_id}: {data}")
-                if response.status != 200:
-                    logger.error(f"Ошибка API Notion: статус {response.status}, данные: {data}")
-                    raise Exception(f"Ошибка API Notion: {data.get('message', 'Неизвестная ошибка')}")
-                if 'properties' not in data:
-                    logger.error(f"Ключ 'properties' отсутствует в ответе для meeting_id {meeting_id}")
-                    raise KeyError("'properties' не найден в ответе Notion API")
-                mentor_relation = data['properties']['Mentor(s)']['relation'][0]['id']
-                mentor_name = await self.get_notion_page_name(mentor_relation)
-                return mentor_name
+        async with self.api_request(
+                self._notion_sem, "GET",
+                f"https://api.notion.com/v1/pages/{meeting_id}",
+                headers=NOTION_GET_HEADERS
+        ) as response:
+            data = await response.json()
+            #logger.debug(f"Ответ от Notion API для meeting_id {meeting_id}: {data}")
+            if response.status != 200:
+                logger.error(f"Ошибка API Notion: статус {response.status}, данные: {data}")
+                raise Exception(f"Ошибка API Notion: {data.get('message', 'Неизвестная ошибка')}")
+            if 'properties' not in data:
+                logger.error(f"Ключ 'properties' отсутствует в ответе для meeting_id {meeting_id}")
+                raise KeyError("'properties' не найден в ответе Notion API")
+            mentor_relation = data['properties']['Mentor(s)']['relation'][0]['id']
+        # Запрос имени выполняется уже после освобождения слота _notion_sem
+        mentor_name = await self.get_mentor_name(mentor_relation)
+        return mentor_name
 
     async def delete_telegram_message(self, chat_id, message_id):
         """Удаление сообщения в Telegram"""
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/deleteMessage"
         payload = {'chat_id': chat_id, 'message_id': message_id}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                return await response.json()
+        async with self.api_request(self._tg_sem, "POST", url, json=payload) as response:
+            return await response.json()
 
     async def run_telegram_polling(self):
         """Polling для обновлений Telegram"""
-        offset = 0
+        # Продолжаем с сохранённого offset, чтобы после перезапуска не обрабатывать старые обновления заново
+        offset = int(self.get_bot_state('tg_offset', 0))
+        backoff = 1
         while True:
             try:
                 updates = await self.get_telegram_updates(offset)
+            except Exception as e:
+                # Любая ошибка получения обновлений не должна завершать цикл (иначе TaskGroup остановит бота).
+                # Если Telegram указал retry_after, ждём не меньше него
+                delay = max(backoff, getattr(e, 'retry_after', None) or 0)
+                logger.error(f"Ошибка при получении обновлений от Telegram: {e}, повтор через {delay} с")
+                await asyncio.sleep(delay)  # Экспоненциальная задержка
+                backoff = min(backoff * 2, TELEGRAM_MAX_BACKOFF)
+                continue
+            backoff = 1
+
+            last_offset = offset
+            try:
                 for update in updates:
                     offset = update['update_id'] + 1
                     if 'callback_query' in update:
@@ -647,37 +923,45 @@ class FeedbackBot:
             except Exception as e:
                 logger.error(f"Ошибка в run_telegram_polling: {e}")
                 await asyncio.sleep(5)  # Задержка перед повторной попыткой
+            finally:
+                if offset != last_offset:
+                    try:
+                        self.set_bot_state('tg_offset', offset)
+                    except sqlite3.Error as e:
+                        logger.error(f"Ошибка сохранения offset Telegram: {e}")
 
     async def get_telegram_updates(self, offset):
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
-        params = {'offset': offset, 'timeout': 30}
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    data = await response.json()
-                    return data.get('result', [])
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logger.error(f"Ошибка при получении обновлений от Telegram: {e}")
-            return []  # Возвращаем пустой список, чтобы цикл продолжился
+        params = {'offset': offset, 'timeout': TELEGRAM_LONG_POLL_TIMEOUT}
+        # Таймаут клиента чуть больше long poll, чтобы aiohttp не оборвал соединение раньше Telegram
+        timeout = aiohttp.ClientTimeout(total=TELEGRAM_LONG_POLL_TIMEOUT + 5, sock_read=TELEGRAM_LONG_POLL_TIMEOUT + 5)
+        async with self.api_request(self._tg_sem, "GET", url, params=params, timeout=timeout) as response:
+            data = await response.json()
+            # 409 (второй poller), 401 (неверный токен), 5xx и т.п. приходят как ok = false
+            if not data.get('ok'):
+                raise TelegramAPIError(
+                    f"getUpdates: {data.get('error_code')} {data.get('description', 'Неизвестная ошибка')}",
+                    data.get('parameters', {}).get('retry_after')
+                )
+            return data.get('result', [])
 
     async def get_meeting_summary(self, meeting_id):
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28"
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                    f"https://api.notion.com/v1/pages/{meeting_id}",
-                    headers=headers
-            ) as response:
-                data = await response.json()
-                summary_property = data['properties'].get('Summary', {})
-                if summary_property and summary_property['type'] == 'rich_text':
-                    summary_text = ''.join([text['plain_text'] for text in summary_property['rich_text']])
-                    return summary_text
-                return None
+        async with self.api_request(
+                self._notion_sem, "GET",
+                f"https://api.notion.com/v1/pages/{meeting_id}",
+                headers=NOTION_GET_HEADERS
+        ) as response:
+            data = await response.json()
+            summary_property = data['properties'].get('Summary', {})
+            if summary_property and summary_property['type'] == 'rich_text':
+                summary_text = ''.join([text['plain_text'] for text in summary_property['rich_text']])
+                return summary_text
+            return None
 
 
 if __name__ == "__main__":
     bot = FeedbackBot()
-    asyncio.run(bot.start())
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(bot.start())
+    else:
+        asyncio.run(bot.start())